@@ -1,5 +1,7 @@
 import asyncio
+import json
 import logging
+from functools import partial
 from typing import Optional
 from urllib.parse import quote as quote_url
 
@@ -47,6 +49,10 @@ class APIClient:
         else:
             kwargs['headers'] = auth_headers
 
+        # Serialise request bodies without the default whitespace,
+        # which adds up on the bulk endpoints used by the syncers.
+        kwargs.setdefault('json_serialize', partial(json.dumps, separators=(',', ':')))
+
         self.session = None
         self.loop = loop
 
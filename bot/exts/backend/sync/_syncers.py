@@ -1,16 +1,25 @@
 import abc
+import asyncio
 import logging
+import math
 import typing as t
 from collections import namedtuple
+from operator import attrgetter
 
-from discord import Guild
+from discord import Guild, Member
 from discord.ext.commands import Context
+from more_itertools import chunked
 
 from bot.api import ResponseCodeError
 from bot.bot import Bot
 
 log = logging.getLogger(__name__)
 
+# Bulk user requests are split into chunks of this many users. At most `MAX_CONCURRENT_REQUESTS`
+# requests are sent to the site at once, whether they're role requests, user chunks or user pages.
+USER_CHUNK_SIZE = 1000
+MAX_CONCURRENT_REQUESTS = 4
+
 # These objects are declared as namedtuples because tuples are hashable,
 # something that we make use of when diffing site roles against guild roles.
 _Role = namedtuple('Role', ('id', 'name', 'colour', 'permissions', 'position'))
@@ -53,6 +62,12 @@ class Syncer(abc.ABC):
             message = None
         diff = await self._get_diff(guild)
 
+        if not any(diff):
+            log.info(f"{self.name} syncer finished: no changes.")
+            if message:
+                await message.edit(content=f":ok_hand: Synchronisation of {self.name}s complete: no changes")
+            return
+
         try:
             await self._sync(diff)
         except ResponseCodeError as e:
@@ -62,8 +77,7 @@ class Syncer(abc.ABC):
             results = f"status {e.status}\n```{e.response_json or 'See log output for details'}```"
             content = f":x: Synchronisation of {self.name}s failed: {results}"
         else:
-            diff_dict = diff._asdict()
-            results = (f"{name} `{len(val)}`" for name, val in diff_dict.items() if val is not None)
+            results = (f"{name} `{len(val)}`" for name, val in zip(diff._fields, diff) if val is not None)
             results = ", ".join(results)
 
             log.info(f"{self.name} syncer finished: {results}.")
@@ -84,45 +98,59 @@ class RoleSyncer(Syncer):
         roles = await self.bot.api_client.get('bot/roles')
 
         # Pack DB roles and guild roles into one common, hashable format.
-        # They're hashable so that they're easily comparable with sets later.
-        db_roles = {_Role(**role_dict) for role_dict in roles}
+        # Both are indexed by ID so that they can be matched against each other.
+        db_roles = {role_dict["id"]: _Role(**role_dict) for role_dict in roles}
+        get_role_fields = attrgetter("id", "name", "colour", "permissions", "position")
         guild_roles = {
-            _Role(
-                id=role.id,
-                name=role.name,
-                colour=role.colour.value,
-                permissions=role.permissions.value,
-                position=role.position,
-            )
-            for role in guild.roles
+            id_: _Role(id_, name, colour.value, permissions.value, position)
+            for id_, name, colour, permissions, position in map(get_role_fields, guild.roles)
         }
 
-        guild_role_ids = {role.id for role in guild_roles}
-        api_role_ids = {role.id for role in db_roles}
-        new_role_ids = guild_role_ids - api_role_ids
-        deleted_role_ids = api_role_ids - guild_role_ids
+        if not db_roles:
+            # Nothing has been synced yet, so every guild role is new.
+            return _Diff(set(guild_roles.values()), set(), set())
+
+        roles_to_create = set()
+        roles_to_update = set()
+
+        for role_id, role in guild_roles.items():
+            db_role = db_roles.get(role_id)
+
+            if db_role is None:
+                # The role is on the cached guild but not on the DB guild,
+                # going by the role ID. We need to send it in for creation.
+                roles_to_create.add(role)
+            elif db_role != role:
+                roles_to_update.add(role)
 
-        # New roles are those which are on the cached guild but not on the
-        # DB guild, going by the role ID. We need to send them in for creation.
-        roles_to_create = {role for role in guild_roles if role.id in new_role_ids}
-        roles_to_update = guild_roles - db_roles - roles_to_create
-        roles_to_delete = {role for role in db_roles if role.id in deleted_role_ids}
+        roles_to_delete = {db_roles[role_id] for role_id in db_roles.keys() - guild_roles.keys()}
 
         return _Diff(roles_to_create, roles_to_update, roles_to_delete)
 
     async def _sync(self, diff: _Diff) -> None:
         """Synchronise the database with the role cache of `guild`."""
+        # Unlike users, the site API has no bulk endpoints for roles, so each role needs its
+        # own request. They're sent concurrently to avoid paying the latency once per role.
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def send(request: t.Callable, endpoint: str, **kwargs) -> None:
+            async with semaphore:
+                await request(endpoint, **kwargs)
+
         log.trace("Syncing created roles...")
-        for role in diff.created:
-            await self.bot.api_client.post('bot/roles', json=role._asdict())
+        await asyncio.gather(*(
+            send(self.bot.api_client.post, 'bot/roles', json=role._asdict()) for role in diff.created
+        ))
 
         log.trace("Syncing updated roles...")
-        for role in diff.updated:
-            await self.bot.api_client.put(f'bot/roles/{role.id}', json=role._asdict())
+        await asyncio.gather(*(
+            send(self.bot.api_client.put, f'bot/roles/{role.id}', json=role._asdict()) for role in diff.updated
+        ))
 
         log.trace("Syncing deleted roles...")
-        for role in diff.deleted:
-            await self.bot.api_client.delete(f'bot/roles/{role.id}')
+        await asyncio.gather(*(
+            send(self.bot.api_client.delete, f'bot/roles/{role.id}') for role in diff.deleted
+        ))
 
 
 class UserSyncer(Syncer):
@@ -133,29 +161,45 @@ class UserSyncer(Syncer):
     async def _get_diff(self, guild: Guild) -> _Diff:
         """Return the difference of users between the cache of `guild` and the database."""
         log.trace("Getting the diff for users.")
+        db_users = [db_user async for db_user in self._get_users()]
+
+        if not db_users:
+            # Nothing has been synced yet, so every guild member is new.
+            return _Diff(guild.members, [], None)
+
+        # Diffing a large guild takes long enough to stall the event loop, so do it in a thread.
+        # `Guild.members` builds a new list, so the thread works on a snapshot of the members.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compute_diff, db_users, guild.members)
 
-        users_to_create = []
+    def _compute_diff(self, db_users: t.List[dict], members: t.List[Member]) -> _Diff:
+        """Return the difference between the `db_users` and the guild `members`."""
         users_to_update = []
-        seen_guild_users = set()
 
-        async for db_user in self._get_users():
+        # Guild members which haven't been matched to a DB user yet.
+        unseen_guild_users = {member.id: member for member in members}
+
+        for db_user in db_users:
             # Store user fields which are to be updated.
             updated_fields = {}
 
-            def maybe_update(db_field: str, guild_value: t.Union[str, int]) -> None:
+            if guild_user := unseen_guild_users.pop(db_user["id"], None):
                 # Equalize DB user and guild user attributes.
-                if db_user[db_field] != guild_value:
-                    updated_fields[db_field] = guild_value
+                if db_user["name"] != guild_user.name:
+                    updated_fields["name"] = guild_user.name
 
-            if guild_user := guild.get_member(db_user["id"]):
-                seen_guild_users.add(guild_user.id)
+                discriminator = int(guild_user.discriminator)
+                if db_user["discriminator"] != discriminator:
+                    updated_fields["discriminator"] = discriminator
 
-                maybe_update("name", guild_user.name)
-                maybe_update("discriminator", int(guild_user.discriminator))
-                maybe_update("in_guild", True)
+                if not db_user["in_guild"]:
+                    updated_fields["in_guild"] = True
 
-                guild_roles = [role.id for role in guild_user.roles]
-                if set(db_user["roles"]) != set(guild_roles):
+                # Compare sorted role IDs rather than sets; the lengths are checked
+                # first so that the DB roles only need sorting if they might match.
+                db_roles = db_user["roles"]
+                guild_roles = self._get_role_ids(guild_user)
+                if len(db_roles) != len(guild_roles) or sorted(db_roles) != guild_roles:
                     updated_fields["roles"] = guild_roles
 
             elif db_user["in_guild"]:
@@ -170,39 +214,105 @@ class UserSyncer(Syncer):
                 updated_fields["id"] = db_user["id"]
                 users_to_update.append(updated_fields)
 
-        for member in guild.members:
-            if member.id not in seen_guild_users:
-                # The user is known on the guild but not on the API. This means
-                # that the user has joined since the last sync. Create it.
-                new_user = {
-                    "id": member.id,
-                    "name": member.name,
-                    "discriminator": int(member.discriminator),
-                    "roles": [role.id for role in member.roles],
-                    "in_guild": True
-                }
-                users_to_create.append(new_user)
+        # Any members left are known on the guild but not on the API. This means
+        # that they have joined since the last sync, so they need to be created.
+        # Their payloads are only built in chunks when they're sent, to limit peak memory.
+        users_to_create = list(unseen_guild_users.values())
 
         return _Diff(users_to_create, users_to_update, None)
 
     async def _get_users(self) -> t.AsyncIterable:
         """GET users from database."""
-        query_params = {
-            "page": 1
-        }
-        while query_params["page"]:
-            res = await self.bot.api_client.get("bot/users", params=query_params)
-            for user in res["results"]:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def get_page(page: int) -> t.Optional[dict]:
+            async with semaphore:
+                try:
+                    return await self.bot.api_client.get("bot/users", params={"page": page})
+                except ResponseCodeError as e:
+                    # Users may have been removed after the count was read, leaving fewer pages.
+                    if page == 1 or e.status != 404:
+                        raise
+                    return None
+
+        pages = [await get_page(1)]
+
+        if pages[0]["next_page_no"]:
+            # Every page but the last one is full, so the amount of pages
+            # can be worked out from the size of the first one.
+            page_count = math.ceil(pages[0]["count"] / len(pages[0]["results"]))
+            pages += await asyncio.gather(*(get_page(page) for page in range(2, page_count + 1)))
+
+            # Pages which no longer exist mark the end of the users.
+            if None in pages:
+                del pages[pages.index(None):]
+
+        # Users may have been created after the count was read, so follow any pages beyond it.
+        while next_page_no := pages[-1]["next_page_no"]:
+            if (page := await get_page(next_page_no)) is None:
+                break
+            pages.append(page)
+
+        for page in pages:
+            for user in page["results"]:
                 yield user
 
-            query_params["page"] = res["next_page_no"]
-
     async def _sync(self, diff: _Diff) -> None:
         """Synchronise the database with the user cache of `guild`."""
         log.trace("Syncing created users...")
         if diff.created:
-            await self.bot.api_client.post("bot/users", json=diff.created)
+            new_users = map(self._get_new_user, diff.created)
+            await self._send_chunked(self.bot.api_client.post, "bot/users", new_users)
 
         log.trace("Syncing updated users...")
         if diff.updated:
-            await self.bot.api_client.patch("bot/users/bulk_patch", json=diff.updated)
+            await self._send_chunked(self.bot.api_client.patch, "bot/users/bulk_patch", diff.updated)
+
+    def _get_new_user(self, member: Member) -> dict:
+        """Return the payload to create a user in the database from the guild `member`."""
+        return {
+            "id": member.id,
+            "name": member.name,
+            "discriminator": int(member.discriminator),
+            "roles": self._get_role_ids(member),
+            "in_guild": True
+        }
+
+    @staticmethod
+    def _get_role_ids(member: Member) -> t.List[int]:
+        """
+        Return the sorted IDs of the roles of `member`, including the @everyone role.
+
+        This reads the raw role IDs of the member rather than `Member.roles`,
+        which builds every role object and sorts them by position.
+        """
+        guild = member.guild
+
+        # discord.py doesn't remove deleted roles from `_roles`, so filter out IDs which are no
+        # longer in the guild's cache, like `Member.roles` does. They don't exist on the site either.
+        # The IDs in `_roles` are kept sorted by discord.py. The @everyone role shares its ID
+        # with the guild, which is older than any of its other roles, so it always sorts first.
+        return [guild.id, *(role_id for role_id in member._roles if role_id in guild._roles)]
+
+    @staticmethod
+    async def _send_chunked(request: t.Callable, endpoint: str, users: t.Iterable[dict]) -> None:
+        """Send `users` to `endpoint` using the `request` method, in concurrent chunks."""
+        chunks = chunked(users, USER_CHUNK_SIZE)
+        failed = False
+
+        async def send_chunks() -> None:
+            nonlocal failed
+
+            # The iterator is shared, so each chunk is sent by whichever coroutine gets to it first.
+            for chunk in chunks:
+                # Once a request has failed the sync is reported as failed, so stop sending chunks.
+                if failed:
+                    return
+
+                try:
+                    await request(endpoint, json=chunk)
+                except Exception:
+                    failed = True
+                    raise
+
+        await asyncio.gather(*(send_chunks() for _ in range(MAX_CONCURRENT_REQUESTS)))
@@ -3,7 +3,7 @@ from unittest import mock
 
 
 from bot.api import ResponseCodeError
-from bot.exts.backend.sync._syncers import Syncer
+from bot.exts.backend.sync._syncers import Syncer, _Diff
 from tests import helpers
 
 
@@ -35,8 +35,8 @@ class SyncerSyncTests(unittest.IsolatedAsyncioTestCase):
         self.syncer = TestSyncer(self.bot)
         self.guild = helpers.MockGuild()
 
-        # Make sure `_get_diff` returns a MagicMock, not an AsyncMock
-        self.syncer._get_diff.return_value = mock.MagicMock()
+        self.syncer._get_diff.return_value = _Diff({1}, set(), None)
+        self.syncer._sync.reset_mock(side_effect=True)
 
     async def test_sync_message_edited(self):
         """The message should be edited if one was sent, even if the sync has an API error."""
@@ -71,3 +71,16 @@ class SyncerSyncTests(unittest.IsolatedAsyncioTestCase):
 
                 if ctx is not None:
                     ctx.send.assert_called_once()
+
+    async def test_sync_skipped_for_empty_diff(self):
+        """No API calls should be made if the diff is empty, but the message should still be edited."""
+        self.syncer._get_diff.return_value = _Diff(set(), set(), None)
+        ctx = helpers.MockContext()
+        message = helpers.MockMessage()
+        ctx.send.return_value = message
+
+        await self.syncer.sync(self.guild, ctx)
+
+        self.syncer._sync.assert_not_called()
+        message.edit.assert_called_once()
+        self.assertIn("no changes", message.edit.call_args[1]["content"])
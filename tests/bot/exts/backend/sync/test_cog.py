@@ -140,6 +140,7 @@ class SyncCogListenerTests(SyncCogTestCase):
 
     def tearDown(self):
         self.guild_id_patcher.stop()
+        super().tearDown()
 
     async def test_sync_cog_on_guild_role_create(self):
         """A POST request should be sent with the new role's data."""
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from unittest import mock
 
@@ -73,6 +74,18 @@ class RoleSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(actual_diff, expected_diff)
 
+    async def test_diff_for_new_roles_with_empty_db(self):
+        """When the DB has no roles, every role of the guild should be created."""
+        roles = [fake_role(), fake_role(id=41, name="new")]
+
+        self.bot.api_client.get.return_value = []
+        guild = self.get_guild(*roles)
+
+        actual_diff = await self.syncer._get_diff(guild)
+        expected_diff = ({_Role(**role) for role in roles}, set(), set())
+
+        self.assertEqual(actual_diff, expected_diff)
+
     async def test_diff_for_deleted_roles(self):
         """Only deleted roles should be added to the 'deleted' set of the diff."""
         deleted_role = fake_role(id=61, name="deleted")
@@ -155,3 +168,23 @@ class RoleSyncerSyncTests(unittest.IsolatedAsyncioTestCase):
 
         self.bot.api_client.post.assert_not_called()
         self.bot.api_client.put.assert_not_called()
+
+    @mock.patch("bot.exts.backend.sync._syncers.MAX_CONCURRENT_REQUESTS", 2)
+    async def test_sync_limits_concurrent_requests(self):
+        """No more than `MAX_CONCURRENT_REQUESTS` requests should be in flight at once."""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def put(endpoint, json):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0)
+            in_flight -= 1
+
+        self.bot.api_client.put.side_effect = put
+        role_tuples = {_Role(**fake_role(id=id_)) for id_ in range(5)}
+        await self.syncer._sync(_Diff(set(), role_tuples, set()))
+
+        self.assertEqual(self.bot.api_client.put.call_count, 5)
+        self.assertEqual(max_in_flight, 2)
@@ -1,5 +1,8 @@
+import asyncio
 import unittest
+from unittest import mock
 
+from bot.api import ResponseCodeError
 from bot.exts.backend.sync._syncers import UserSyncer, _Diff
 from tests import helpers
 
@@ -9,12 +12,28 @@ def fake_user(**kwargs):
     kwargs.setdefault("id", 43)
     kwargs.setdefault("name", "bob the test man")
     kwargs.setdefault("discriminator", 1337)
-    kwargs.setdefault("roles", [666])
+    kwargs.setdefault("roles", [0, 666])
     kwargs.setdefault("in_guild", True)
 
     return kwargs
 
 
+def fake_member(user):
+    """Fixture to return a guild member mock matching the given `fake_user` dictionary."""
+    member = user.copy()
+    del member["in_guild"]
+
+    mock_member = helpers.MockMember(**member)
+
+    # The first role is @everyone, which shares the guild's ID and isn't stored in `_roles`.
+    everyone_role_id, *role_ids = member["roles"]
+    mock_member.guild = helpers.MockGuild(id=everyone_role_id)
+    mock_member.guild._roles = {role_id: helpers.MockRole(id=role_id) for role_id in member["roles"]}
+    mock_member._roles = role_ids
+
+    return mock_member
+
+
 class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
     """Tests for determining differences between users in the DB and users in the Guild cache."""
 
@@ -26,27 +45,10 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
     def get_guild(*members):
         """Fixture to return a guild object with the given members."""
         guild = helpers.MockGuild()
-        guild.members = []
-
-        for member in members:
-            member = member.copy()
-            del member["in_guild"]
-
-            mock_member = helpers.MockMember(**member)
-            mock_member.roles = [helpers.MockRole(id=role_id) for role_id in member["roles"]]
-
-            guild.members.append(mock_member)
+        guild.members = [fake_member(member) for member in members]
 
         return guild
 
-    @staticmethod
-    def get_mock_member(member: dict):
-        member = member.copy()
-        del member["in_guild"]
-        mock_member = helpers.MockMember(**member)
-        mock_member.roles = [helpers.MockRole(id=role_id) for role_id in member["roles"]]
-        return mock_member
-
     async def test_empty_diff_for_no_users(self):
         """When no users are given, an empty diff should be returned."""
         self.bot.api_client.get.return_value = {
@@ -62,6 +64,21 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(actual_diff, expected_diff)
 
+    async def test_diff_for_new_users_with_empty_db(self):
+        """When the DB has no users, every member of the guild should be created."""
+        self.bot.api_client.get.return_value = {
+            "count": 0,
+            "next_page_no": None,
+            "previous_page_no": None,
+            "results": []
+        }
+        guild = self.get_guild(fake_user(), fake_user(id=99))
+
+        actual_diff = await self.syncer._get_diff(guild)
+        expected_diff = (guild.members, [], None)
+
+        self.assertEqual(actual_diff, expected_diff)
+
     async def test_empty_diff_for_identical_users(self):
         """No differences should be found if the users in the guild and DB are identical."""
         self.bot.api_client.get.return_value = {
@@ -72,7 +89,6 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
         }
         guild = self.get_guild(fake_user())
 
-        guild.get_member.return_value = self.get_mock_member(fake_user())
         actual_diff = await self.syncer._get_diff(guild)
         expected_diff = ([], [], None)
 
@@ -89,10 +105,6 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
             "results": [fake_user(id=99, name="old"), fake_user()]
         }
         guild = self.get_guild(updated_user, fake_user())
-        guild.get_member.side_effect = [
-            self.get_mock_member(updated_user),
-            self.get_mock_member(fake_user())
-        ]
 
         actual_diff = await self.syncer._get_diff(guild)
         expected_diff = ([], [{"id": 99, "name": "new"}], None)
@@ -110,12 +122,8 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
             "results": [fake_user()]
         }
         guild = self.get_guild(fake_user(), new_user)
-        guild.get_member.side_effect = [
-            self.get_mock_member(fake_user()),
-            self.get_mock_member(new_user)
-        ]
         actual_diff = await self.syncer._get_diff(guild)
-        expected_diff = ([new_user], [], None)
+        expected_diff = ([guild.members[1]], [], None)
 
         self.assertEqual(actual_diff, expected_diff)
 
@@ -128,10 +136,6 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
             "results": [fake_user(), fake_user(id=63)]
         }
         guild = self.get_guild(fake_user())
-        guild.get_member.side_effect = [
-            self.get_mock_member(fake_user()),
-            None
-        ]
 
         actual_diff = await self.syncer._get_diff(guild)
         expected_diff = ([], [{"id": 63, "in_guild": False}], None)
@@ -151,14 +155,25 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
             "results": [fake_user(), fake_user(id=55), fake_user(id=63)]
         }
         guild = self.get_guild(fake_user(), new_user, updated_user)
-        guild.get_member.side_effect = [
-            self.get_mock_member(fake_user()),
-            self.get_mock_member(updated_user),
-            None
-        ]
 
         actual_diff = await self.syncer._get_diff(guild)
-        expected_diff = ([new_user], [{"id": 55, "name": "updated"}, {"id": 63, "in_guild": False}], None)
+        expected_diff = ([guild.members[1]], [{"id": 55, "name": "updated"}, {"id": 63, "in_guild": False}], None)
+
+        self.assertEqual(actual_diff, expected_diff)
+
+    async def test_empty_diff_for_deleted_guild_roles(self):
+        """Roles which were deleted from the guild but are still cached on a member should be ignored."""
+        self.bot.api_client.get.return_value = {
+            "count": 1,
+            "next_page_no": None,
+            "previous_page_no": None,
+            "results": [fake_user()]
+        }
+        guild = self.get_guild(fake_user())
+        guild.members[0]._roles = [666, 777]
+
+        actual_diff = await self.syncer._get_diff(guild)
+        expected_diff = ([], [], None)
 
         self.assertEqual(actual_diff, expected_diff)
 
@@ -171,16 +186,47 @@ class UserSyncerDiffTests(unittest.IsolatedAsyncioTestCase):
             "results": [fake_user(), fake_user(id=63, in_guild=False)]
         }
         guild = self.get_guild(fake_user())
-        guild.get_member.side_effect = [
-            self.get_mock_member(fake_user()),
-            None
-        ]
 
         actual_diff = await self.syncer._get_diff(guild)
         expected_diff = ([], [], None)
 
         self.assertEqual(actual_diff, expected_diff)
 
+    async def test_get_users_fetches_every_page(self):
+        """All pages of users should be requested, and their users returned in order."""
+        users = [fake_user(id=id_) for id_ in range(5)]
+        pages = {
+            1: {"count": 5, "next_page_no": 2, "previous_page_no": None, "results": users[:2]},
+            2: {"count": 5, "next_page_no": 3, "previous_page_no": 1, "results": users[2:4]},
+            3: {"count": 5, "next_page_no": None, "previous_page_no": 2, "results": users[4:]},
+        }
+        self.bot.api_client.get.side_effect = lambda endpoint, params: pages[params["page"]]
+
+        actual_users = [user async for user in self.syncer._get_users()]
+
+        self.assertEqual(actual_users, users)
+        self.assertEqual(self.bot.api_client.get.call_count, len(pages))
+
+    async def test_get_users_stops_at_missing_pages(self):
+        """Pages which no longer exist because users were removed should be treated as the end."""
+        users = [fake_user(id=id_) for id_ in range(4)]
+        pages = {
+            1: {"count": 5, "next_page_no": 2, "previous_page_no": None, "results": users[:2]},
+            2: {"count": 4, "next_page_no": None, "previous_page_no": 1, "results": users[2:]},
+        }
+
+        def get(endpoint, params):
+            if params["page"] not in pages:
+                raise ResponseCodeError(mock.MagicMock(status=404))
+            return pages[params["page"]]
+
+        self.bot.api_client.get.side_effect = get
+
+        actual_users = [user async for user in self.syncer._get_users()]
+
+        self.assertEqual(actual_users, users)
+        self.assertEqual(self.bot.api_client.get.call_count, 3)
+
 
 class UserSyncerSyncTests(unittest.IsolatedAsyncioTestCase):
     """Tests for the API requests that sync users."""
@@ -193,10 +239,10 @@ class UserSyncerSyncTests(unittest.IsolatedAsyncioTestCase):
         """Only POST requests should be made with the correct payload."""
         users = [fake_user(id=111), fake_user(id=222)]
 
-        diff = _Diff(users, [], None)
+        diff = _Diff([fake_member(user) for user in users], [], None)
         await self.syncer._sync(diff)
 
-        self.bot.api_client.post.assert_called_once_with("bot/users", json=diff.created)
+        self.bot.api_client.post.assert_called_once_with("bot/users", json=users)
 
         self.bot.api_client.put.assert_not_called()
         self.bot.api_client.delete.assert_not_called()
@@ -212,3 +258,42 @@ class UserSyncerSyncTests(unittest.IsolatedAsyncioTestCase):
 
         self.bot.api_client.post.assert_not_called()
         self.bot.api_client.delete.assert_not_called()
+
+    @mock.patch("bot.exts.backend.sync._syncers.USER_CHUNK_SIZE", 2)
+    async def test_sync_users_in_chunks(self):
+        """Users should be sent in chunks of at most `USER_CHUNK_SIZE` users."""
+        users = [fake_user(id=id_) for id_ in range(5)]
+
+        diff = _Diff([fake_member(user) for user in users], users, None)
+        await self.syncer._sync(diff)
+
+        subtests = (
+            (self.bot.api_client.post, "bot/users"),
+            (self.bot.api_client.patch, "bot/users/bulk_patch"),
+        )
+
+        for method, endpoint in subtests:
+            with self.subTest(endpoint=endpoint):
+                calls = [mock.call(endpoint, json=users[i:i + 2]) for i in range(0, 5, 2)]
+                method.assert_has_calls(calls, any_order=True)
+                self.assertEqual(method.call_count, len(calls))
+
+    @mock.patch("bot.exts.backend.sync._syncers.MAX_CONCURRENT_REQUESTS", 2)
+    @mock.patch("bot.exts.backend.sync._syncers.USER_CHUNK_SIZE", 1)
+    async def test_sync_stops_sending_chunks_after_failure(self):
+        """No more chunks should be sent once a request has failed."""
+        users = [fake_user(id=id_) for id_ in range(5)]
+
+        async def post(endpoint, json):
+            await asyncio.sleep(0)
+            if json[0]["id"] == 0:
+                raise ResponseCodeError(mock.MagicMock(status=400))
+
+        self.bot.api_client.post.side_effect = post
+        diff = _Diff([fake_member(user) for user in users], [], None)
+
+        with self.assertRaises(ResponseCodeError):
+            await self.syncer._sync(diff)
+
+        # Only the two chunks which were already in flight when the first one failed are sent.
+        self.assertEqual(self.bot.api_client.post.call_count, 2)